@@ -1,25 +1,62 @@
+import asyncio
 import random
+from contextlib import asynccontextmanager
 
 import httpx
+import orjson
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import HTMLResponse
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response, StreamingResponse
 import urllib.parse
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import bulkio
 import dbmanager
+import idempotency
+import ratelimit
+import stats
 
 from api_internal import (
     GachaPullRequest,
     GachaTokensRequest,
+    MessageResponse,
+    ErrorResponse,
+    PlayerMessageResponse,
+    GachaPullResponse,
+    PlayerProfileResponse,
+    LeaderboardEntryResponse,
+    LeaderboardResponse,
+    StatsResponse,
     validate_and_get_player,
+    get_player_profile_internal,
     is_admin,
     trigger_event_internal,
     add_tokens_internal,
+    add_tokens_to_all_internal,
     gacha_pull_internal
 )
 
-app = FastAPI()
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    purge_task = asyncio.create_task(idempotency.purge_expired_keys())
+    rebuild_task = asyncio.create_task(stats.rebuild_periodically())
+    yield
+    purge_task.cancel()
+    rebuild_task.cancel()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,9 +67,44 @@ app.add_middleware(
 )
 
 
-@app.get("/")
+@app.exception_handler(ratelimit.RateLimitExceeded)
+async def rate_limit_exceeded(request: Request, exc: ratelimit.RateLimitExceeded):
+    return ORJSONResponse(
+        status_code=429,
+        content=ErrorResponse(error="Too many requests").model_dump(),
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+
+@app.exception_handler(dbmanager.PlayerMovedError)
+async def player_moved(request: Request, exc: dbmanager.PlayerMovedError):
+    # Nothing was committed, so the client can safely send the same request again
+    return ORJSONResponse(
+        status_code=503,
+        content=ErrorResponse(error="Player is being moved, try again").model_dump(),
+        headers={"Retry-After": "1"},
+    )
+
+
+def respond(request: Request, model: BaseModel) -> Response:
+    """
+    Serializes a response model straight to bytes, skipping FastAPI's response validation.
+    Clients that accept application/msgpack get a msgpack body if msgpack is installed.
+    """
+    if negotiated_media_type(request) == MSGPACK_MEDIA_TYPE:
+        return Response(content=msgpack.packb(model.model_dump()), media_type=MSGPACK_MEDIA_TYPE)
+    return ORJSONResponse(content=model.model_dump())
+
+
+def negotiated_media_type(request: Request) -> str:
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        return MSGPACK_MEDIA_TYPE
+    return "application/json"
+
+
+@app.get("/", response_model=MessageResponse)
 async def root():
-    return {"message": "Hello there!"}
+    return MessageResponse(message="Hello there!")
 
 
 @app.get("/oauth/callback", response_class=HTMLResponse)
@@ -62,76 +134,218 @@ async def oauth():
 
 
 @app.post("/api/1/{token}/me")
-async def itch_user(token: str):
+async def itch_user(token: str, http_request: Request):
+    return await fetch_itch_user(token, ratelimit.client_ip(http_request))
+
+
+async def fetch_itch_user(token: str, ip: str) -> dict:
     url = f"https://itch.io/api/1/{token}/me"
-    async with httpx.AsyncClient() as client:
+    async with ratelimit.outbound_slot(ratelimit.auth_outbound_limiter, ip), httpx.AsyncClient() as client:
         response = await client.get(url)
         response.raise_for_status()
         return response.json()
 
 
-@app.get("/api/1/image")
-async def get_image(image_url: str):
+@app.get("/api/1/image", response_model=ErrorResponse)
+async def get_image(http_request: Request, image_url: str):
     if not image_url.startswith("https://"):
-        return {"error": "Invalid image URL. It must start with 'https://'."}
-    async with httpx.AsyncClient() as client:
+        return ErrorResponse(error="Invalid image URL. It must start with 'https://'.")
+    ratelimit.check_image(http_request)
+    image_slot = ratelimit.outbound_slot(ratelimit.image_outbound_limiter, ratelimit.client_ip(http_request))
+    async with image_slot, httpx.AsyncClient() as client:
         parsed = urllib.parse.urlparse(image_url)
         image_url = "https://" + parsed.hostname + parsed.path + urllib.parse.quote("#" + parsed.fragment)
         print(image_url)
         response = await client.get(image_url)
         if response.status_code != 200:
-            return {"error": "Failed to fetch image."}
+            return ErrorResponse(error="Failed to fetch image.")
         return HTMLResponse(content=response.content, media_type="image/png")
 
 
-@app.post("/api/circus/{token}/player/trigger_event")
-async def trigger_event(token: str, event_id: str):
-    db_player = await validate_and_get_player(token)
-    if db_player is None:
-        return {"error": "Invalid token"}
-
-    seen_events = db_player.seen_events.split(",") if db_player.seen_events else []
-    if event_id in seen_events:
-        return {"message": "Event already triggered", "player_id": db_player.player_id}
-    if await trigger_event_internal(event_id, db_player) > 0:
-        return {"message": "Event not found", "player_id": db_player.player_id}
-    seen_events.append(event_id)
-    db_player.seen_events = ",".join(seen_events)
-    dbmanager.update_model(db_player)
-    return {"message": "Event triggered successfully", "player_id": db_player.player_id}
-
-
-@app.post("/api/circus/{token}/player/link_mc/{mc_username}")
-async def link_mc_username(token: str, mc_username: str):
-    if len(mc_username) > 16 or not mc_username.isalnum():
-        return {"error": "Invalid Minecraft username. It must be alphanumeric and up to 16 characters long."}
-    db_player = await validate_and_get_player(token)
-    if db_player is None:
-        return {"error": "Invalid token"}
-    db_player.mc_username = mc_username
-    dbmanager.update_model(db_player)
-    return {"message": "Minecraft username linked successfully", "player_id": db_player.player_id}
+@app.get("/api/circus/stats", response_model=StatsResponse)
+async def server_stats():
+    return StatsResponse(counters=dbmanager.get_counters())
 
 
-@app.post("/api/circus/{token}/gacha/pull")
-async def gacha_pull(token: str, request: GachaPullRequest):
-    db_player = await validate_and_get_player(token)
+@app.get("/api/circus/stats/leaderboard/{board}", response_model=LeaderboardResponse | ErrorResponse)
+async def leaderboard(
+        board: str,
+        http_request: Request,
+        cursor: str | None = None,
+        limit: int = Query(default=50, ge=1, le=100)
+):
+    if board not in stats.BOARDS:
+        return ErrorResponse(error=f"Unknown leaderboard. It must be one of: {', '.join(stats.BOARDS)}.")
+    after = stats.decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        return ErrorResponse(error="Invalid cursor")
+    entries, next_cursor = stats.get_leaderboard(board, after, limit)
+    return respond(http_request, LeaderboardResponse(
+        board=board,
+        entries=[
+            LeaderboardEntryResponse(player_id=player_id, mc_username=mc_username, score=score)
+            for player_id, mc_username, score in entries
+        ],
+        next_cursor=next_cursor,
+    ))
+
+
+@app.get("/api/circus/{token}/player", response_model=PlayerProfileResponse | ErrorResponse)
+async def player_profile(token: str, http_request: Request):
+    db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
     if db_player is None:
-        return {"error": "Invalid token"}
-    pull_result = await gacha_pull_internal(db_player, request.pulls)
-    return {"message": "Gacha pull completed", "results": pull_result}
+        return ErrorResponse(error="Invalid token")
+    return respond(http_request, await get_player_profile_internal(db_player))
+
+
+@app.post("/api/circus/{token}/player/trigger_event", response_model=PlayerMessageResponse | ErrorResponse)
+async def trigger_event(
+        token: str,
+        event_id: str,
+        http_request: Request,
+        idempotency_key: str | None = Header(default=None)
+):
+    async def handle():
+        db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
+        if db_player is None:
+            return respond(http_request, ErrorResponse(error="Invalid token"))
+
+        seen_events = db_player.seen_events.split(",") if db_player.seen_events else []
+        if event_id in seen_events:
+            return respond(http_request, PlayerMessageResponse(
+                message="Event already triggered", player_id=db_player.player_id))
+        if await trigger_event_internal(event_id, db_player) > 0:
+            return respond(http_request, PlayerMessageResponse(
+                message="Event not found", player_id=db_player.player_id))
+        seen_events.append(event_id)
+        db_player.seen_events = ",".join(seen_events)
+        dbmanager.update_model(db_player)
+        return respond(http_request, PlayerMessageResponse(
+            message="Event triggered successfully", player_id=db_player.player_id))
+
+    return await idempotency.run_idempotent(http_request, token, idempotency_key, handle)
+
+
+@app.post("/api/circus/{token}/player/link_mc/{mc_username}", response_model=PlayerMessageResponse | ErrorResponse)
+async def link_mc_username(
+        token: str,
+        mc_username: str,
+        http_request: Request,
+        idempotency_key: str | None = Header(default=None)
+):
+    async def handle():
+        if len(mc_username) > 16 or not mc_username.isalnum():
+            return respond(http_request, ErrorResponse(
+                error="Invalid Minecraft username. It must be alphanumeric and up to 16 characters long."))
+        db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
+        if db_player is None:
+            return respond(http_request, ErrorResponse(error="Invalid token"))
+        db_player.mc_username = mc_username
+        dbmanager.update_model(db_player)
+        return respond(http_request, PlayerMessageResponse(
+            message="Minecraft username linked successfully", player_id=db_player.player_id))
+
+    return await idempotency.run_idempotent(http_request, token, idempotency_key, handle)
+
+
+@app.post("/api/circus/{token}/gacha/pull", response_model=GachaPullResponse | ErrorResponse)
+async def gacha_pull(
+        token: str,
+        request: GachaPullRequest,
+        http_request: Request,
+        idempotency_key: str | None = Header(default=None)
+):
+    ratelimit.check_gacha_ip(http_request)
+
+    async def handle():
+        db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
+        if db_player is None:
+            return respond(http_request, ErrorResponse(error="Invalid token"))
+        ratelimit.check_gacha_player(db_player.player_id)
+        pull_result = await gacha_pull_internal(db_player, request.pulls)
+        return respond(http_request, GachaPullResponse(message="Gacha pull completed", results=pull_result))
+
+    return await idempotency.run_idempotent(http_request, token, idempotency_key, handle)
+
+
+@app.post("/api/circus/{token}/gacha/tokens", response_model=PlayerMessageResponse | ErrorResponse)
+async def add_tokens(
+        token: str,
+        request: GachaTokensRequest,
+        http_request: Request,
+        idempotency_key: str | None = Header(default=None)
+):
+    async def handle():
+        amount = request.amount
+        db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
+        if db_player is None:
+            return respond(http_request, ErrorResponse(error="Invalid token"))
+        if not await is_admin(db_player):
+            return respond(http_request, ErrorResponse(error="Unauthorized"))
+        await add_tokens_internal(db_player, amount)
+        return respond(http_request, PlayerMessageResponse(
+            message=f"Added {amount} tokens", player_id=db_player.player_id))
+
+    return await idempotency.run_idempotent(http_request, token, idempotency_key, handle)
+
+
+@app.post("/api/circus/{token}/gacha/tokens/all", response_model=MessageResponse | ErrorResponse)
+async def add_tokens_to_all(
+        token: str,
+        request: GachaTokensRequest,
+        http_request: Request,
+        idempotency_key: str | None = Header(default=None)
+):
+    async def handle():
+        amount = request.amount
+        db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
+        if db_player is None:
+            return respond(http_request, ErrorResponse(error="Invalid token"))
+        if not await is_admin(db_player):
+            return respond(http_request, ErrorResponse(error="Unauthorized"))
+        players = await add_tokens_to_all_internal(amount)
+        return respond(http_request, MessageResponse(message=f"Added {amount} tokens to {players} players"))
+
+    return await idempotency.run_idempotent(http_request, token, idempotency_key, handle)
 
 
-@app.post("/api/circus/{token}/gacha/tokens")
-async def add_tokens(token: str, request: GachaTokensRequest):
-    amount = request.amount
-    db_player = await validate_and_get_player(token)
+@app.get("/api/circus/{token}/admin/export/{table}", response_model=ErrorResponse)
+async def export_table(
+        token: str,
+        table: str,
+        http_request: Request,
+        shard: int | None = Query(default=None, ge=0),
+        after: str | None = None
+):
+    db_player = await validate_and_get_player(token, ratelimit.client_ip(http_request))
     if db_player is None:
-        return {"error": "Invalid token"}
+        return ErrorResponse(error="Invalid token")
     if not await is_admin(db_player):
-        return {"error": "Unauthorized"}
-    await add_tokens_internal(db_player, amount)
-    return {"message": f"Added {amount} tokens", "player_id": db_player.player_id}
+        return ErrorResponse(error="Unauthorized")
+    if table not in bulkio.TABLES:
+        return ErrorResponse(error=f"Unknown table. It must be one of: {', '.join(bulkio.TABLES)}.")
+    # Each request streams a single shard, export them one by one with shard=0..SHARD_COUNT-1
+    if shard is None:
+        if dbmanager.SHARD_COUNT > 1:
+            return ErrorResponse(error=f"Missing shard. There are {dbmanager.SHARD_COUNT} shards, export each one.")
+        shard = dbmanager.HOME_SHARD
+    if shard >= dbmanager.SHARD_COUNT:
+        return ErrorResponse(error=f"Unknown shard. There are {dbmanager.SHARD_COUNT} shards.")
+    # after is the JSON primary key of the last row received from that shard, e.g. [42], to resume an export
+    try:
+        after_key = orjson.loads(after) if after else None
+    except orjson.JSONDecodeError:
+        after_key = None
+    # Validated here, since errors inside the stream would only surface after the 200 headers
+    primary_key_length = len(bulkio.primary_key(bulkio.TABLES[table]))
+    if after and not (
+            isinstance(after_key, list)
+            and len(after_key) == primary_key_length
+            and all(isinstance(value, (int, float, str)) for value in after_key)
+    ):
+        return ErrorResponse(
+            error=f"Invalid after key. It must be a JSON list of {primary_key_length} primary key value(s).")
+    return StreamingResponse(bulkio.iter_ndjson(table, shard, after_key), media_type="application/x-ndjson")
 
 
 def start():
@@ -1,8 +1,13 @@
+import asyncio
 import random
 
 import yaml
+import catalog
 import dbmanager
-from pydantic import BaseModel
+import stats
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from ratelimit import MAX_PULLS_PER_REQUEST
 
 
 # Linear interpolation function
@@ -14,7 +19,7 @@ def lerp(a, b, weight):
 
 
 class GachaPullRequest(BaseModel):
-    pulls: int
+    pulls: int = Field(ge=1, le=MAX_PULLS_PER_REQUEST)
     chosen_unit: str = ""
 
 
@@ -22,20 +27,116 @@ class GachaTokensRequest(BaseModel):
     amount: int
 
 
-async def validate_and_get_player(token: str) -> dbmanager.DBPlayer | None:
-    itch_id = await get_itch_id_from_token(token)
+# <<< RESPONSES >>> #
+class MessageResponse(BaseModel):
+    message: str
+
+
+class ErrorResponse(BaseModel):
+    error: str
+
+
+class PlayerMessageResponse(BaseModel):
+    message: str
+    player_id: int
+
+
+class GachaPullResponse(BaseModel):
+    message: str
+    results: dict[str, int]
+
+
+class LeaderboardEntryResponse(BaseModel):
+    player_id: int
+    mc_username: str | None
+    score: int
+
+
+class LeaderboardResponse(BaseModel):
+    board: str
+    entries: list[LeaderboardEntryResponse]
+    next_cursor: str | None
+
+
+class StatsResponse(BaseModel):
+    counters: dict[str, int]
+
+
+class BadgeResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    badge_id: str
+    badge_name: str
+    uses: int | None
+    cooldown_date: str | None
+
+
+class RPGItemResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    item_id: str
+    item_name: str
+    item_type: str | None
+
+
+class ValleyItemResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    item_id: str
+    item_name: str
+    item_uses: int | None
+    cooldown_date: str | None
+
+
+class UnitResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    unit_id: str
+    unit_name: str
+    unit_rarity: str | None
+
+
+class PlayerProfileResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    player_id: int
+    itch_id: int | None
+    mc_username: str | None
+    pity: int | None
+    up_rate: float | None
+    pull_tokens: int | None
+    total_pulls: int | None
+    seen_events: list[str]
+    inventory: dict[str, int] = {}
+    equipped_badge: str | None
+    badges: list[BadgeResponse]
+    rpg_items: list[RPGItemResponse]
+    valley_items: list[ValleyItemResponse]
+    units: list[UnitResponse]
+
+    @field_validator("seen_events", mode="before")
+    @classmethod
+    def split_seen_events(cls, value):
+        if isinstance(value, str):
+            return value.split(",") if value else []
+        return value
+
+
+async def validate_and_get_player(token: str, ip: str) -> dbmanager.DBPlayer | None:
+    itch_id = await get_itch_id_from_token(token, ip)
     if itch_id is None:
         return None
     db_player = dbmanager.get_db_player_from_itch_id(itch_id)
     if not db_player:
+        stats.record_new_player()
         db_player = dbmanager.create_db_player(itch_id)
     return db_player
 
 
-async def get_itch_id_from_token(token: str) -> int | None:
+async def get_itch_id_from_token(token: str, ip: str) -> int | None:
     # This function will call the API endpoint defined in api.py
-    from api import itch_user
-    response = await itch_user(token)
+    from api import fetch_itch_user
+    response = await fetch_itch_user(token, ip)
     if response.get("error"):
         return None
     return response.get("user").get("id")
@@ -48,6 +149,12 @@ async def is_admin(player: dbmanager.DBPlayer) -> bool:
     return itch_id in [7258425]
 
 
+async def get_player_profile_internal(player: dbmanager.DBPlayer) -> PlayerProfileResponse:
+    profile = PlayerProfileResponse.model_validate(player)
+    profile.inventory = catalog.item_names(dbmanager.get_inventory(player.player_id))
+    return profile
+
+
 async def trigger_event_internal(event_id: str, player: dbmanager.DBPlayer) -> int:
     with open("objects.yaml") as f:
         objects = yaml.safe_load(f)
@@ -57,16 +164,29 @@ async def trigger_event_internal(event_id: str, player: dbmanager.DBPlayer) -> i
             return 1
 
         print(f"Event {event_id} triggered for player {player.mc_username}")
+        stats.record_event(event_id)
         return 0
 
 
 async def add_tokens_internal(player: dbmanager.DBPlayer, amount: int) -> None:
     if amount <= 0:
         return
-    player.pull_tokens = (player.pull_tokens or 0) + amount
+    dbmanager.add_pull_tokens(player, amount)
+    stats.record_tokens(amount)
     dbmanager.update_model(player)
 
 
+async def add_tokens_to_all_internal(amount: int) -> int:
+    if amount <= 0:
+        return 0
+    # The fan-out touches every player row, so keep it off the event loop
+    players = await asyncio.to_thread(dbmanager.add_tokens_to_all_players, amount)
+    dbmanager.expire_players()
+    stats.record_tokens(amount * players)
+    dbmanager.commit()
+    return players
+
+
 async def gacha_pull_internal(player: dbmanager.DBPlayer, pulls: int) -> dict:
     up_rate = player.up_rate
     pity = player.pity
@@ -152,9 +272,12 @@ async def gacha_pull_internal(player: dbmanager.DBPlayer, pulls: int) -> dict:
         else:
             pity = 0
 
-    player.pull_tokens -= pulls
+    dbmanager.add_pull_tokens(player, -pulls)
     player.total_pulls += pulls
     player.pity = pity
     player.up_rate = up_rate
+    items = catalog.intern_items(pull_result)
+    dbmanager.add_inventory(player.player_id, items)
+    stats.record_pull(player, pulls, items)
     dbmanager.update_model(player)
     return pull_result
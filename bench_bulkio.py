@@ -0,0 +1,89 @@
+"""
+Measures bulk import and export throughput for a synthetic player dataset.
+
+    python bench_bulkio.py --players 1000000 --items-per-player 5
+
+It writes synthetic dbplayer and inventoryitem NDJSON files, imports them with bulkio, then
+exports both tables back out, reporting rows/s and the process' peak RSS after each step.
+Set CIRCUS_SHARD_COUNT to benchmark a sharded layout. Everything runs in a temporary directory.
+"""
+import argparse
+import os
+import random
+import resource
+import time
+
+import orjson
+
+from bench_common import enter_workdir
+
+workdir = enter_workdir("bench_bulkio_")
+
+import bulkio  # noqa: E402
+import catalog  # noqa: E402
+import dbmanager  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_players(path: str, players: int) -> None:
+    with open(path, "wb") as f:
+        for player_id in range(1, players + 1):
+            f.write(orjson.dumps({
+                "player_id": player_id,
+                "itch_id": player_id,
+                "mc_username": f"player{player_id}",
+                "pity": random.randint(0, 60),
+                "up_rate": random.random(),
+                "pull_tokens": random.randint(0, 500),
+                "total_pulls": random.randint(0, 5000),
+                "seen_events": "tutorial_complete",
+                "equipped_badge": None,
+            }) + b"\n")
+
+
+def write_inventory(path: str, players: int, items_per_player: int) -> None:
+    with open(path, "wb") as f:
+        for player_id in range(1, players + 1):
+            for item_code in sorted(random.sample(range(len(catalog.ITEM_NAMES)), items_per_player)):
+                f.write(orjson.dumps({"player_id": player_id, "item_code": item_code,
+                                      "amount": random.randint(1, 1000)}) + b"\n")
+
+
+def timed(name: str, rows_expected: int | None, call) -> None:
+    start = time.perf_counter()
+    rows = call()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {rows:>9} rows  {elapsed:7.2f}s  {rows / elapsed:10.0f} rows/s  peak RSS {peak_rss_mb():7.1f} MB")
+    if rows_expected is not None and rows != rows_expected:
+        print(f"  expected {rows_expected} rows")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000000)
+    parser.add_argument("--items-per-player", type=int, default=5)
+    args = parser.parse_args()
+
+    dbmanager.initialize_database()
+    players_path = os.path.join(workdir, "players.ndjson")
+    inventory_path = os.path.join(workdir, "inventory.ndjson")
+    write_players(players_path, args.players)
+    write_inventory(inventory_path, args.players, args.items_per_player)
+    inventory_rows = args.players * args.items_per_player
+    print(f"{args.players} players, {inventory_rows} inventory rows, {dbmanager.SHARD_COUNT} shard(s), "
+          f"baseline peak RSS {peak_rss_mb():.1f} MB")
+
+    timed("import dbplayer", args.players, lambda: bulkio.import_ndjson("dbplayer", players_path))
+    timed("import inventoryitem", inventory_rows, lambda: bulkio.import_ndjson("inventoryitem", inventory_path))
+    timed("export dbplayer", args.players,
+          lambda: bulkio.export_ndjson("dbplayer", os.path.join(workdir, "export_players.ndjson")))
+    timed("export inventoryitem", inventory_rows,
+          lambda: bulkio.export_ndjson("inventoryitem", os.path.join(workdir, "export_inventory.ndjson")))
+
+
+if __name__ == "__main__":
+    main()
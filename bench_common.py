@@ -0,0 +1,23 @@
+import os
+import shutil
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def enter_workdir(prefix: str) -> str:
+    """
+    Moves into a fresh temporary directory holding a copy of objects.yaml. The database URLs are
+    relative and resolved when dbmanager is imported, so call this before importing it.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    shutil.copy(os.path.join(REPO_DIR, "objects.yaml"), workdir)
+    os.chdir(workdir)
+    return workdir
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
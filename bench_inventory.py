@@ -0,0 +1,82 @@
+"""
+Measures applying a 100-pull gacha result to a player's inventory.
+
+    python bench_inventory.py --players 1000 --iterations 500
+
+It compares the batched upsert used by gacha_pull_internal (dbmanager.add_inventory) with a
+per-item ORM read-modify-write, and also times a full 100-pull gacha_pull_internal call.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from bench_common import enter_workdir, percentile
+
+enter_workdir("bench_inventory_")
+
+import api_internal  # noqa: E402
+import catalog  # noqa: E402
+import dbmanager  # noqa: E402
+from dbmanager import InventoryItem  # noqa: E402
+
+
+def pull_result(pulls: int) -> dict[str, int]:
+    # Spread over the whole catalog, so nearly every item code is touched like a large pull
+    result = {}
+    for _ in range(pulls * 2):
+        name = random.choice(catalog.ITEM_NAMES)
+        result[name] = result.get(name, 0) + random.randint(1, 5)
+    return result
+
+
+def apply_batched(player: dbmanager.DBPlayer, items: dict[int, int]) -> None:
+    dbmanager.add_inventory(player.player_id, items)
+    dbmanager.update_model(player)
+
+
+def apply_per_item(player: dbmanager.DBPlayer, items: dict[int, int]) -> None:
+    shard_session = dbmanager.session_for_player(player.player_id)
+    for item_code, amount in items.items():
+        item = shard_session.get(InventoryItem, (player.player_id, item_code))
+        if item is None:
+            item = InventoryItem(player_id=player.player_id, item_code=item_code, amount=0)
+        item.amount += amount
+        shard_session.add(item)
+    dbmanager.update_model(player)
+
+
+def time_calls(name: str, iterations: int, call) -> None:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    print(
+        f"{name:<28} p50={percentile(samples, 50) * 1000:7.3f}ms "
+        f"p99={percentile(samples, 99) * 1000:7.3f}ms "
+        f"ops/s={iterations / sum(samples):8.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    dbmanager.initialize_database()
+    players = [dbmanager.create_db_player(itch_id) for itch_id in range(1, args.players + 1)]
+    results = [catalog.intern_items(pull_result(100)) for _ in range(64)]
+    print(f"{len(results[0])} distinct items per 100-pull result, {args.players} players")
+
+    time_calls("batched upsert", args.iterations,
+               lambda: apply_batched(random.choice(players), random.choice(results)))
+    time_calls("per-item read-modify-write", args.iterations,
+               lambda: apply_per_item(random.choice(players), random.choice(results)))
+    time_calls("gacha_pull_internal(100)", args.iterations,
+               lambda: asyncio.run(api_internal.gacha_pull_internal(random.choice(players), 100)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Measures gacha pull latency for a well-behaved client, alone and while another process floods
+the server with random tokens from a different IP, first on the gacha route and then on the
+profile route, which has no IP rate limit and only the per-IP outbound cap in front of the
+itch.io lookup.
+
+    python bench_ratelimit.py --seconds 15 --abusers 200
+
+The server runs under uvicorn in its own process, with the itch.io lookup replaced by a fake
+that sleeps for --itch-latency while holding an outbound slot. The legit client connects from
+127.0.0.1 and the abusive one from 127.0.0.2, so they land in different IP buckets.
+"""
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import random
+import statistics
+import time
+
+import httpx
+
+from bench_common import enter_workdir, percentile
+
+PORT = 4469
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+
+def serve(itch_latency: float, players: int) -> None:
+    enter_workdir("bench_ratelimit_")
+    import uvicorn
+
+    import api
+    import api_internal
+    import dbmanager
+    import ratelimit
+
+    async def fake_itch_id(token: str, ip: str) -> int | None:
+        async with ratelimit.outbound_slot(ratelimit.auth_outbound_limiter, ip):
+            await asyncio.sleep(itch_latency)
+        return int(token[1:]) if token.startswith("t") else None
+
+    api_internal.get_itch_id_from_token = fake_itch_id
+    dbmanager.initialize_database()
+    for itch_id in range(1, players + 1):
+        player = dbmanager.create_db_player(itch_id)
+        player.pull_tokens = 10 ** 9
+        dbmanager.update_model(player)
+    uvicorn.run(api.app, host="127.0.0.1", port=PORT, log_level="warning")
+
+
+ABUSED_ROUTES = {
+    "gacha": ("POST", "/api/circus/{token}/gacha/pull"),
+    "profile": ("GET", "/api/circus/{token}/player"),
+}
+
+
+async def flood(route: str, abusers: int, seconds: float) -> None:
+    method, path = ABUSED_ROUTES[route]
+    transport = httpx.AsyncHTTPTransport(local_address="127.0.0.2", limits=httpx.Limits(max_connections=abusers))
+    deadline = time.perf_counter() + seconds
+
+    async def abuser(client: httpx.AsyncClient) -> None:
+        while time.perf_counter() < deadline:
+            try:
+                token = f"bad{random.getrandbits(64)}"
+                await client.request(method, path.format(token=token), json={"pulls": 100} if method == "POST" else None)
+            except httpx.HTTPError:
+                pass
+
+    async with httpx.AsyncClient(transport=transport, base_url=BASE_URL, timeout=30) as client:
+        await asyncio.gather(*[abuser(client) for _ in range(abusers)])
+
+
+def run_flood(route: str, abusers: int, seconds: float) -> None:
+    asyncio.run(flood(route, abusers, seconds))
+
+
+async def legit_client(seconds: float, rate: float, players: int) -> tuple[list[float], dict[int, int]]:
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=30) as client:
+        # Round-robin over the players, so each stays within its own per-player limit
+        for request_number in itertools.count():
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            token = f"t{request_number % players + 1}"
+            response = await client.post(f"/api/circus/{token}/gacha/pull", json={"pulls": 1})
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            await asyncio.sleep(max(0.0, 1 / rate - elapsed))
+    return latencies, statuses
+
+
+def report(name: str, latencies: list[float], statuses: dict[int, int]) -> None:
+    print(
+        f"{name:<24} n={len(latencies):<6} "
+        f"p50={percentile(latencies, 50) * 1000:8.2f}ms "
+        f"p99={percentile(latencies, 99) * 1000:8.2f}ms "
+        f"mean={statistics.fmean(latencies) * 1000:8.2f}ms "
+        f"statuses={dict(sorted(statuses.items()))}"
+    )
+
+
+def wait_for_server() -> None:
+    for _ in range(100):
+        try:
+            httpx.get(BASE_URL + "/")
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--abusers", type=int, default=200, help="Concurrent abusive connections")
+    parser.add_argument("--legit-rate", type=float, default=4, help="Legit requests per second, under the gacha IP limit")
+    parser.add_argument("--legit-players", type=int, default=20, help="Players the legit requests are spread over")
+    parser.add_argument("--itch-latency", type=float, default=0.2, help="Seconds per fake itch.io lookup")
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(target=serve, args=(args.itch_latency, args.legit_players), daemon=True)
+    server.start()
+    try:
+        wait_for_server()
+        report("legit, no abuse", *asyncio.run(legit_client(args.seconds, args.legit_rate, args.legit_players)))
+        for route in ABUSED_ROUTES:
+            # Let the legit player's bucket refill between phases
+            time.sleep(10)
+            flooder = multiprocessing.Process(target=run_flood, args=(route, args.abusers, args.seconds + 1))
+            flooder.start()
+            time.sleep(0.5)
+            report(f"legit, {args.abusers} on {route}",
+                   *asyncio.run(legit_client(args.seconds, args.legit_rate, args.legit_players)))
+            flooder.join()
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
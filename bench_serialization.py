@@ -0,0 +1,102 @@
+"""
+Compares the old and new response serialization paths for a 100-pull gacha result and a full
+player profile.
+
+    python bench_serialization.py --number 2000
+
+The old path is what FastAPI does with an ad-hoc dict and no response model: jsonable_encoder
+followed by JSONResponse. The new paths build the typed model and go through respond(), as
+JSON and as msgpack.
+"""
+import argparse
+import random
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from bench_common import enter_workdir
+
+enter_workdir("bench_serialization_")
+
+import api  # noqa: E402
+import catalog  # noqa: E402
+from api_internal import GachaPullResponse, PlayerProfileResponse  # noqa: E402
+
+
+def make_request(accept: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"accept", accept.encode())]})
+
+
+def pull_result() -> dict:
+    # Roughly what 100 pulls produce: most catalog items show up at least once
+    return {name: random.randint(1, 40) for name in catalog.ITEM_NAMES}
+
+
+def profile() -> dict:
+    return {
+        "player_id": 1,
+        "itch_id": 7258425,
+        "mc_username": "steve",
+        "pity": 12,
+        "up_rate": 0.43,
+        "pull_tokens": 120,
+        "total_pulls": 4800,
+        "seen_events": "tutorial_complete,first_pull,halloween",
+        "inventory": pull_result(),
+        "equipped_badge": "jester",
+        "badges": [
+            {"badge_id": f"badge_{i}", "badge_name": f"Badge {i}", "uses": -1, "cooldown_date": ""}
+            for i in range(13)
+        ],
+        "rpg_items": [{"item_id": f"rpg_{i}", "item_name": "stick", "item_type": "weapon"} for i in range(50)],
+        "valley_items": [
+            {"item_id": f"valley_{i}", "item_name": "stick", "item_uses": 1, "cooldown_date": ""}
+            for i in range(50)
+        ],
+        "units": [
+            {"unit_id": f"unit_{i}", "unit_name": "juggler", "unit_rarity": "common"}
+            for i in range(200)
+        ],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    json_request = make_request("application/json")
+    msgpack_request = make_request(api.MSGPACK_MEDIA_TYPE)
+    if api.msgpack is None:
+        print("msgpack is not installed, the msgpack rows fall back to JSON")
+
+    results = pull_result()
+    pull = {"message": "Gacha pull completed", "results": results}
+    player = profile()
+    cases = {
+        "100-pull result": (
+            lambda: JSONResponse(jsonable_encoder(pull)),
+            lambda: api.respond(json_request, GachaPullResponse(message="Gacha pull completed", results=results)),
+            lambda: api.respond(msgpack_request, GachaPullResponse(message="Gacha pull completed", results=results)),
+        ),
+        "full profile": (
+            lambda: JSONResponse(jsonable_encoder(player)),
+            lambda: api.respond(json_request, PlayerProfileResponse.model_validate(player)),
+            lambda: api.respond(msgpack_request, PlayerProfileResponse.model_validate(player)),
+        ),
+    }
+
+    for name, (old, new_json, new_msgpack) in cases.items():
+        print(name)
+        baseline = None
+        for label, encode in (("jsonable_encoder", old), ("respond json", new_json), ("respond msgpack", new_msgpack)):
+            per_call = min(timeit.repeat(encode, number=args.number, repeat=5)) / args.number
+            baseline = baseline or per_call
+            size = len(encode().body)
+            print(f"  {label:<18} {per_call * 1e6:8.1f}us  {baseline / per_call:5.2f}x  {size:6d} bytes")
+
+
+if __name__ == "__main__":
+    main()
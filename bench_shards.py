@@ -0,0 +1,108 @@
+"""
+Measures concurrent player write throughput with one shard and with several.
+
+    python bench_shards.py --shards 1 2 4 --threads 8 --seconds 5
+
+Each shard count runs in its own process (CIRCUS_SHARD_COUNT is read at import) and temporary
+directory. Worker threads repeatedly apply a gacha-like write to a random player: bump the
+player row and upsert a handful of inventory items on the player's shard, then commit. Writes
+to the home shard's global tables are left out, so this shows what splitting the player tables
+buys on its own.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from bench_common import REPO_DIR, enter_workdir
+
+
+def run_workers(players: int, threads: int, seconds: float, items: int) -> None:
+    enter_workdir("bench_shards_")
+    import catalog
+    import dbmanager
+    from sqlalchemy import update
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from sqlalchemy.exc import OperationalError
+    from sqlmodel import Session
+
+    dbmanager.initialize_database()
+    player_ids = [dbmanager.create_db_player(itch_id).player_id for itch_id in range(1, players + 1)]
+    shards = dbmanager.get_player_shards(set(player_ids))
+    item_codes = range(len(catalog.ITEM_NAMES))
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+    retries = [0] * threads
+
+    def write(thread: int) -> None:
+        # Like fan_out tasks, every thread needs its own sessions
+        shard_sessions = [Session(shard_engine) for shard_engine in dbmanager.engines]
+        while time.perf_counter() < deadline:
+            player_id = random.choice(player_ids)
+            shard_session = shard_sessions[shards[player_id]]
+            rows = [
+                {"player_id": player_id, "item_code": item_code, "amount": random.randint(1, 5)}
+                for item_code in random.sample(item_codes, items)
+            ]
+            statement = sqlite_insert(dbmanager.InventoryItem).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=["player_id", "item_code"],
+                set_={"amount": dbmanager.InventoryItem.amount + statement.excluded.amount},
+            )
+            try:
+                shard_session.execute(
+                    update(dbmanager.DBPlayer)
+                    .where(dbmanager.DBPlayer.player_id == player_id)
+                    .values(total_pulls=dbmanager.DBPlayer.total_pulls + 1)
+                )
+                shard_session.execute(statement)
+                shard_session.commit()
+                counts[thread] += 1
+            except OperationalError:
+                # "database is locked" after the busy timeout, the write is simply retried
+                shard_session.rollback()
+                retries[thread] += 1
+        for shard_session in shard_sessions:
+            shard_session.close()
+
+    workers = [threading.Thread(target=write, args=(thread,)) for thread in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{dbmanager.SHARD_COUNT:>2} shard(s)  {threads} threads  {sum(counts):>8} writes  "
+        f"{sum(counts) / elapsed:9.1f} writes/s  {sum(retries)} locked retries"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--items", type=int, default=10, help="Inventory items upserted per write")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_workers(args.players, args.threads, args.seconds, args.items)
+        return
+    for shard_count in args.shards:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--players", str(args.players),
+             "--threads", str(args.threads), "--seconds", str(args.seconds), "--items", str(args.items)],
+            env={**os.environ, "CIRCUS_SHARD_COUNT": str(shard_count)},
+            cwd=REPO_DIR,
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
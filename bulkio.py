@@ -0,0 +1,244 @@
+import argparse
+import os
+from typing import Iterator
+
+import orjson
+from sqlalchemy import Table, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import dbmanager
+from dbmanager import formatlog
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Ordered so that players are imported before the rows they own
+TABLES: dict[str, Table] = {model.__tablename__: model.__table__ for model in dbmanager.PLAYER_TABLES}
+CHUNK_SIZE = 10000
+
+
+def primary_key(table: Table) -> list:
+    return list(table.primary_key.columns)
+
+
+def primary_key_of(table: Table, row: dict) -> list:
+    return [row[column.name] for column in primary_key(table)]
+
+
+# <<< CHECKPOINTS >>> #
+def checkpoint_path(path: str) -> str:
+    return path.rstrip("/") + ".checkpoint"
+
+
+def read_checkpoint(path: str) -> dict | None:
+    if not os.path.exists(checkpoint_path(path)):
+        return None
+    with open(checkpoint_path(path), "rb") as f:
+        return orjson.loads(f.read())
+
+
+def write_checkpoint(path: str, checkpoint: dict) -> None:
+    # Written to a temporary file and renamed, so a crash never leaves a torn checkpoint
+    temp_path = checkpoint_path(path) + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(orjson.dumps(checkpoint))
+    os.replace(temp_path, checkpoint_path(path))
+
+
+def clear_checkpoint(path: str) -> None:
+    if os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+
+
+def shard_path(path: str, shard: int) -> str:
+    if dbmanager.SHARD_COUNT == 1:
+        return path
+    return f"{path.rstrip('/')}.shard{shard}"
+
+
+# <<< EXPORT >>> #
+def iter_chunks(table_name: str, shard: int, after: list | None = None, chunk_size: int = CHUNK_SIZE) -> Iterator[list[dict]]:
+    """
+    Streams a table from one shard in primary key order, chunk_size rows at a time, starting
+    after the given primary key. Rows are fetched through a streaming cursor, so memory stays
+    constant.
+    """
+    table = TABLES[table_name]
+    statement = select(table).order_by(*primary_key(table))
+    if after is not None:
+        statement = statement.where(tuple_(*primary_key(table)) > tuple_(*after))
+    with dbmanager.engines[shard].connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+        for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+
+
+def iter_ndjson(table_name: str, shard: int, after: list | None = None) -> Iterator[bytes]:
+    # One shard only: rows of different shards are not in a common key order, so a client could
+    # not tell where to resume
+    for chunk in iter_chunks(table_name, shard, after):
+        yield b"".join(orjson.dumps(row) + b"\n" for row in chunk)
+
+
+def export_ndjson(table_name: str, path: str, resume: bool = False) -> int:
+    """
+    Exports every shard in parallel, into path.shardN files when there is more than one shard.
+    """
+    return sum(dbmanager.fan_out(lambda shard: export_shard_ndjson(table_name, shard, shard_path(path, shard), resume)))
+
+
+def export_shard_ndjson(table_name: str, shard: int, path: str, resume: bool) -> int:
+    table = TABLES[table_name]
+    checkpoint = read_checkpoint(path) if resume else None
+    mode = "r+b" if checkpoint else "wb"
+    exported = 0
+    with open(path, mode) as f:
+        after = None
+        if checkpoint:
+            # Drop anything written after the last checkpoint before continuing
+            f.truncate(checkpoint["offset"])
+            f.seek(checkpoint["offset"])
+            after = checkpoint["after"]
+        for chunk in iter_chunks(table_name, shard, after):
+            f.write(b"".join(orjson.dumps(row) + b"\n" for row in chunk))
+            f.flush()
+            exported += len(chunk)
+            write_checkpoint(path, {"offset": f.tell(), "after": primary_key_of(table, chunk[-1])})
+    clear_checkpoint(path)
+    return exported
+
+
+def export_parquet(table_name: str, path: str, resume: bool = False) -> int:
+    """
+    Writes one part file per chunk into the directory at path (path.shardN per shard), so an
+    interrupted export can continue with the next part.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow to be installed.")
+    return sum(dbmanager.fan_out(lambda shard: export_shard_parquet(table_name, shard, shard_path(path, shard), resume)))
+
+
+def export_shard_parquet(table_name: str, shard: int, path: str, resume: bool) -> int:
+    table = TABLES[table_name]
+    checkpoint = read_checkpoint(path) if resume else None
+    part = checkpoint["part"] if checkpoint else 0
+    after = checkpoint["after"] if checkpoint else None
+    os.makedirs(path, exist_ok=True)
+    exported = 0
+    for chunk in iter_chunks(table_name, shard, after):
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(chunk), os.path.join(path, f"part-{part:05d}.parquet"))
+        part += 1
+        exported += len(chunk)
+        write_checkpoint(path, {"part": part, "after": primary_key_of(table, chunk[-1])})
+    clear_checkpoint(path)
+    return exported
+
+
+# <<< IMPORT >>> #
+def register_players(rows: list[dict]) -> None:
+    entries = [
+        {
+            "player_id": row["player_id"],
+            "itch_id": row.get("itch_id"),
+            "mc_username": row.get("mc_username"),
+            "shard": dbmanager.shard_for_new_player(row["player_id"]),
+        }
+        for row in rows
+    ]
+    with dbmanager.engine.begin() as connection:
+        connection.execute(sqlite_insert(dbmanager.PlayerDirectory.__table__).on_conflict_do_nothing(), entries)
+
+
+def insert_chunk(table_name: str, rows: list[dict]) -> None:
+    """
+    Inserts a chunk in one transaction per shard, routing each row to its player's shard. Rows
+    that already exist are skipped, so a chunk replayed after a crash is harmless.
+    """
+    if table_name == "dbplayer":
+        register_players(rows)
+    player_shards = dbmanager.get_player_shards({row["player_id"] for row in rows if row.get("player_id") is not None})
+    shard_rows: dict[int, list[dict]] = {}
+    for row in rows:
+        shard = player_shards.get(row.get("player_id"), dbmanager.HOME_SHARD)
+        shard_rows.setdefault(shard, []).append(row)
+
+    def insert_shard(shard: int) -> None:
+        if shard not in shard_rows:
+            return
+        with dbmanager.engines[shard].begin() as connection:
+            connection.execute(sqlite_insert(TABLES[table_name]).on_conflict_do_nothing(), shard_rows[shard])
+
+    dbmanager.fan_out(insert_shard)
+
+
+def import_ndjson(table_name: str, path: str, resume: bool = False) -> int:
+    """
+    Imports an NDJSON export in batched transactions of CHUNK_SIZE rows. With resume, it
+    continues after the last committed chunk.
+    """
+    checkpoint = read_checkpoint(path) if resume else None
+    imported = 0
+    with open(path, "rb") as f:
+        if checkpoint:
+            f.seek(checkpoint["offset"])
+        rows = []
+        while True:
+            line = f.readline()
+            if line.strip():
+                rows.append(orjson.loads(line))
+            if len(rows) >= CHUNK_SIZE or (not line and rows):
+                insert_chunk(table_name, rows)
+                imported += len(rows)
+                write_checkpoint(path, {"offset": f.tell()})
+                rows = []
+            if not line:
+                break
+    clear_checkpoint(path)
+    return imported
+
+
+def import_parquet(table_name: str, path: str, resume: bool = False) -> int:
+    if pyarrow is None:
+        raise RuntimeError("Parquet import requires pyarrow to be installed.")
+    checkpoint = read_checkpoint(path) if resume else None
+    parts = sorted(name for name in os.listdir(path) if name.endswith(".parquet"))
+    imported = 0
+    for part in range(checkpoint["part"] if checkpoint else 0, len(parts)):
+        parquet_file = pyarrow.parquet.ParquetFile(os.path.join(path, parts[part]))
+        for batch in parquet_file.iter_batches(batch_size=CHUNK_SIZE):
+            rows = batch.to_pylist()
+            insert_chunk(table_name, rows)
+            imported += len(rows)
+        write_checkpoint(path, {"part": part + 1})
+    clear_checkpoint(path)
+    return imported
+
+
+# <<< CLI >>> #
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk export and import of player data.")
+    parser.add_argument("direction", choices=["export", "import"])
+    parser.add_argument("table", choices=list(TABLES))
+    parser.add_argument(
+        "path",
+        help="NDJSON file, or directory of part files for parquet. Exports from N shards write path.shard0..N-1"
+    )
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    args = parser.parse_args()
+
+    handlers = {
+        ("export", "ndjson"): export_ndjson,
+        ("export", "parquet"): export_parquet,
+        ("import", "ndjson"): import_ndjson,
+        ("import", "parquet"): import_parquet,
+    }
+    count = handlers[(args.direction, args.format)](args.table, args.path, args.resume)
+    formatlog(f'{args.direction.capitalize()}ed {count} rows of "{args.table}" ({args.format}).')
+
+
+if __name__ == "__main__":
+    main()
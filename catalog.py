@@ -0,0 +1,24 @@
+import yaml
+
+with open("objects.yaml") as f:
+    objects = yaml.safe_load(f)
+
+# Dense integer codes for inventory items, interned from the catalog order
+ITEM_NAMES: list[str] = objects['inventory']
+ITEM_CODES: dict[str, int] = {name: code for code, name in enumerate(ITEM_NAMES)}
+
+
+def intern_items(items: dict[str, int]) -> dict[int, int]:
+    return {ITEM_CODES[name]: amount for name, amount in items.items()}
+
+
+def item_names(items: dict[int, int]) -> dict[str, int]:
+    return {ITEM_NAMES[code]: amount for code, amount in items.items()}
+
+
+UNIT_RARITIES = ("common", "uncommon", "rare", "legendary")
+COINS_CODE = ITEM_CODES["coins"]
+UNIT_CODES: dict[int, str] = {
+    code: name.rsplit("_", 1)[0] for code, name in enumerate(ITEM_NAMES)
+    if name.rsplit("_", 1)[0] in UNIT_RARITIES
+}
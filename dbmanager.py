@@ -1,7 +1,17 @@
+import heapq
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 
-from sqlmodel import Field, SQLModel, create_engine, Session, Relationship, select
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Index, MetaData, delete, event, func, insert, inspect, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm.exc import StaleDataError
+from sqlmodel import Field, SQLModel, create_engine, Session, Relationship, select, col
 
 
 def formatlog(msg: str):
@@ -65,13 +75,6 @@ class DBPlayer(SQLModel, table=True):
     pull_tokens: Optional[int] = Field(default=0)
     total_pulls: Optional[int] = Field(default=0)
     seen_events: Optional[str] = Field(default="")  # Comma-separated event IDs
-    candy_a: Optional[int] = Field(default=0)
-    candy_b: Optional[int] = Field(default=0)
-    candy_c: Optional[int] = Field(default=0)
-    candy_d: Optional[int] = Field(default=0)
-    candy_e: Optional[int] = Field(default=0)
-    coins: Optional[int] = Field(default=0)
-    tickets: Optional[int] = Field(default=0)
     rpg_items: list["RPGItem"] = Relationship(
         back_populates="player",
         sa_relationship_kwargs={"foreign_keys": "[RPGItem.player_id]"}
@@ -91,50 +94,324 @@ class DBPlayer(SQLModel, table=True):
     equipped_badge: Optional[str] = Field(default=None, foreign_key="badge.badge_id")
 
 
+class InventoryItem(SQLModel, table=True):
+    # Clustered on (player_id, item_code), so reading a player's inventory is a single range scan
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    player_id: int = Field(primary_key=True, foreign_key="dbplayer.player_id")
+    item_code: int = Field(primary_key=True)  # Index into the catalog inventory list
+    amount: int = Field(default=0)
+
+
+class PlayerDirectory(SQLModel, table=True):
+    player_id: int = Field(primary_key=True)  # Allocated here, so IDs stay unique across shards
+    itch_id: Optional[int] = Field(default=None, index=True, unique=True)
+    mc_username: Optional[str] = Field(default=None, index=True)
+    shard: int = Field(default=0)
+
+
+# The directory as seen from the other shards' connections, which attach the home shard as "home"
+HOME_DIRECTORY = PlayerDirectory.__table__.to_metadata(MetaData(), schema="home")
+
+
+class LeaderboardEntry(SQLModel, table=True):
+    # Only the top entries of each board are kept, see stats.LEADERBOARD_SIZE
+    __table_args__ = (Index("ix_leaderboardentry_board_score", "board", "score", "player_id"),)
+
+    board: str = Field(primary_key=True)
+    player_id: int = Field(primary_key=True, foreign_key="playerdirectory.player_id")
+    score: int = Field(default=0)
+
+
+class StatCounter(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    value: int = Field(default=0)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    key: str = Field(primary_key=True)  # sha256 of token, route and Idempotency-Key header
+    request_hash: str = Field(default="")  # sha256 of response format, query string and body
+    status_code: int = Field(default=200)
+    media_type: str = Field(default="application/json")
+    body: bytes = Field(default=b"")
+    expires_at: float = Field(default=0, index=True)
+
+
 # <<< DATABASE CONNECTION >>> #
-engine = create_engine("sqlite:///database.db")
-session: Session = Session(engine)
+# Players are spread over SHARD_COUNT SQLite files. The home shard is the original database.db,
+# which also holds the global tables: player directory, leaderboards, stats and idempotency keys.
+SHARD_COUNT = int(os.environ.get("CIRCUS_SHARD_COUNT", "1"))
+HOME_SHARD = 0
+GRANT_BATCH_SIZE = 10000
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+PLAYER_TABLES = [DBPlayer, Badge, RPGItem, ValleyItem, Unit, InventoryItem]
+GLOBAL_TABLES = [PlayerDirectory, LeaderboardEntry, StatCounter, IdempotencyKey]
+
+
+def shard_url(shard: int) -> str:
+    if shard == HOME_SHARD:
+        return "sqlite:///database.db"
+    return f"sqlite:///database_{shard}.db"
+
+
+engines = [create_engine(shard_url(shard)) for shard in range(SHARD_COUNT)]
+HOME_DATABASE = os.path.abspath(engines[HOME_SHARD].url.database)
+
+
+def attach_home(dbapi_connection, connection_record) -> None:
+    dbapi_connection.execute("ATTACH DATABASE ? AS home", (HOME_DATABASE,))
+
+
+# Shard connections can read the directory as home.playerdirectory, see live_players()
+for shard_engine in engines[HOME_SHARD + 1:]:
+    event.listen(shard_engine, "connect", attach_home)
+sessions: list[Session] = [Session(shard_engine) for shard_engine in engines]
+engine = engines[HOME_SHARD]
+session: Session = sessions[HOME_SHARD]
+
+
+# <<< SHARD ROUTING >>> #
+T = TypeVar("T")
+
+
+class PlayerMovedError(Exception):
+    def __init__(self, player_id: int):
+        super().__init__(f'Player "{player_id}" was moved to another shard during the request')
+        self.player_id = player_id
+
+
+def shard_for_new_player(player_id: int) -> int:
+    return zlib.crc32(player_id.to_bytes(8, "little")) % SHARD_COUNT
+
+
+def get_directory_entry(player_id: int) -> PlayerDirectory | None:
+    return session.get(PlayerDirectory, player_id)
+
+
+def session_for_player(player_id: int) -> Session:
+    entry = get_directory_entry(player_id)
+    return sessions[entry.shard] if entry else session
+
+
+def session_for_model(model) -> Session:
+    model_session = Session.object_session(model)
+    if model_session is not None:
+        return model_session
+    if isinstance(model, tuple(PLAYER_TABLES)) and model.player_id is not None:
+        return session_for_player(model.player_id)
+    return session
+
+
+def get_from_any_shard(model: type[T], key) -> T | None:
+    for shard_session in sessions:
+        found = shard_session.get(model, key)
+        if found:
+            return found
+    return None
+
+
+def live_players(shard: int):
+    """
+    Returns a subquery of the players the directory assigns to shard. Queries that scan a whole
+    shard filter on it, so rows left behind by an interrupted move are not counted twice.
+    """
+    directory = PlayerDirectory.__table__ if shard == HOME_SHARD else HOME_DIRECTORY
+    return select(directory.c.player_id).where(directory.c.shard == shard)
+
+
+def fan_out(task: Callable[[int], T]) -> list[T]:
+    """
+    Runs task(shard) for every shard in parallel and returns the results in shard order. Tasks
+    must open their own Session, since the module sessions are not thread-safe.
+    """
+    if SHARD_COUNT == 1:
+        return [task(HOME_SHARD)]
+    with ThreadPoolExecutor(max_workers=SHARD_COUNT) as executor:
+        return list(executor.map(task, range(SHARD_COUNT)))
 
 
 # <<< PLAYERS >>> #
 def create_db_player(itch_id: int) -> DBPlayer:
-    db_player = DBPlayer(itch_id=itch_id)
-    session.add(db_player)
+    entry = PlayerDirectory(itch_id=itch_id)
+    session.add(entry)
+    session.flush()
+    entry.shard = shard_for_new_player(entry.player_id)
+    db_player = DBPlayer(player_id=entry.player_id, itch_id=itch_id)
+    shard_session = sessions[entry.shard]
+    shard_session.add(db_player)
+    # The player row is committed first, so the directory never points to a missing player
+    shard_session.commit()
     session.commit()
-    formatlog(f'New player created with ID "{db_player.player_id}" and Itch ID "{itch_id}".')
+    formatlog(f'New player created with ID "{db_player.player_id}" and Itch ID "{itch_id}" on shard {entry.shard}.')
     return db_player
 
 
 def get_db_player_from_id(player_id: int) -> DBPlayer | None:
-    db_player = session.get(DBPlayer, player_id)
+    entry = get_directory_entry(player_id)
+    db_player = sessions[entry.shard].get(DBPlayer, player_id) if entry else None
     if not db_player:
         formatlog(f'Player with ID "{player_id}" not found in the database.')
     return db_player
 
 
 def get_db_player_from_itch_id(itch_id: int) -> DBPlayer | None:
-    statement = select(DBPlayer).where(DBPlayer.itch_id == itch_id)
-    results = session.exec(statement)
-    return results.first()
+    statement = select(PlayerDirectory).where(PlayerDirectory.itch_id == itch_id)
+    entry = session.exec(statement).first()
+    return sessions[entry.shard].get(DBPlayer, entry.player_id) if entry else None
 
 
 def get_db_player_from_mc_username(mc_username: str) -> DBPlayer | None:
-    statement = select(DBPlayer).where(DBPlayer.mc_username == mc_username)
-    results = session.exec(statement)
-    return results.first()
+    statement = select(PlayerDirectory).where(PlayerDirectory.mc_username == mc_username)
+    entry = session.exec(statement).first()
+    return sessions[entry.shard].get(DBPlayer, entry.player_id) if entry else None
+
+
+def add_pull_tokens(player: DBPlayer, amount: int) -> None:
+    # Written as a delta on flush, so a grant that ran after the player was loaded is kept
+    player.pull_tokens = func.coalesce(DBPlayer.pull_tokens, 0) + amount
+
+
+def add_tokens_to_all_players(amount: int) -> int:
+    """
+    Only uses its own sessions, so it can run in a worker thread. Players already loaded in the
+    module sessions keep their old balance until expire_players() is called. Each shard is
+    updated in player_id ranges with a commit per range, so requests never wait long on its lock.
+    """
+    def grant(shard: int) -> int:
+        granted = 0
+        with Session(engines[shard]) as shard_session:
+            last_id = shard_session.exec(select(func.max(DBPlayer.player_id))).one() or 0
+            for start in range(0, last_id, GRANT_BATCH_SIZE):
+                statement = (
+                    update(DBPlayer)
+                    .where(col(DBPlayer.player_id) > start, col(DBPlayer.player_id) <= start + GRANT_BATCH_SIZE)
+                    .values(pull_tokens=func.coalesce(DBPlayer.pull_tokens, 0) + amount)
+                )
+                granted += shard_session.execute(statement).rowcount
+                shard_session.commit()
+        return granted
+
+    return sum(fan_out(grant))
+
+
+def expire_players() -> None:
+    for shard_session in sessions:
+        shard_session.expire_all()
+
+
+def move_player(player_id: int, target_shard: int) -> bool:
+    """
+    Moves a player and everything they own to another shard while the server keeps running.
+    Returns False if the player does not exist or already lives on target_shard.
+    """
+    entry = get_directory_entry(player_id)
+    if entry is None or entry.shard == target_shard:
+        return False
+    source_shard = entry.shard
+
+    def connect(shard: int, home_connection):
+        return nullcontext(home_connection) if shard == HOME_SHARD else engines[shard].connect()
+
+    directory_update = (
+        update(PlayerDirectory).where(col(PlayerDirectory.player_id) == player_id).values(shard=target_shard)
+    )
+    target_committed = False
+    try:
+        with engine.connect() as home_connection:
+            # Requests lock the home shard before the player's shard (stats, then update_model), so
+            # the move takes the home lock first too, otherwise both sides wait on each other
+            home_connection.execute(directory_update)
+            with connect(source_shard, home_connection) as source_connection, \
+                    connect(target_shard, home_connection) as target_connection:
+                # DELETE ... RETURNING takes the rows and the source shard's write lock in one
+                # step, so writes to the player wait for the move and are then refused by update_model
+                moved = {}
+                for model in reversed(PLAYER_TABLES):
+                    table = model.__table__
+                    statement = delete(table).where(table.c.player_id == player_id).returning(*table.c)
+                    moved[table.name] = [dict(row) for row in source_connection.execute(statement).mappings()]
+                for model in PLAYER_TABLES:
+                    table = model.__table__
+                    # Clear leftovers of an earlier move that was interrupted
+                    target_connection.execute(delete(table).where(table.c.player_id == player_id))
+                    if moved[table.name]:
+                        target_connection.execute(insert(table), moved[table.name])
+
+                try:
+                    if target_shard != HOME_SHARD:
+                        target_connection.commit()
+                        target_committed = True
+                    # The directory decides which copy is live, the move takes effect here
+                    home_connection.commit()
+                except Exception:
+                    # SQLite keeps the transaction open after a failed COMMIT and the pool skips the
+                    # rollback of a connection that already ended it, so drop the connections
+                    home_connection.invalidate()
+                    if target_shard != HOME_SHARD:
+                        target_connection.invalidate()
+                    raise
+                if source_shard != HOME_SHARD:
+                    try:
+                        source_connection.commit()
+                    except Exception as e:
+                        source_connection.invalidate()
+                        # The rows left on the source are skipped by live_players() and cleared
+                        # by the next move to that shard
+                        formatlog(f'Player "{player_id}" moved, but clearing shard {source_shard} failed: {e!r}')
+    except Exception:
+        # Runs after the connections were closed, so the home locks are released by now
+        if target_committed:
+            delete_player_rows(target_shard, player_id)
+        raise
+
+    session.expire(entry)
+    sessions[source_shard].expunge_all()
+    formatlog(f'Moved player "{player_id}" from shard {source_shard} to shard {target_shard}.')
+    return True
+
+
+def delete_player_rows(shard: int, player_id: int) -> None:
+    with engines[shard].begin() as connection:
+        for model in reversed(PLAYER_TABLES):
+            table = model.__table__
+            connection.execute(delete(table).where(table.c.player_id == player_id))
+
+
+def get_player_shards(player_ids: set[int]) -> dict[int, int]:
+    if not player_ids:
+        return {}
+    statement = (
+        select(PlayerDirectory.player_id, PlayerDirectory.shard)
+        .where(col(PlayerDirectory.player_id).in_(player_ids))
+    )
+    with Session(engine) as directory_session:
+        return dict(directory_session.exec(statement).all())
+
+
+def get_directory_page(after: int, limit: int) -> list[tuple[int, int]]:
+    statement = (
+        select(PlayerDirectory.player_id, PlayerDirectory.shard)
+        .where(col(PlayerDirectory.player_id) > after)
+        .order_by(col(PlayerDirectory.player_id))
+        .limit(limit)
+    )
+    return list(session.exec(statement).all())
 
 
 # <<< BADGES >>> #
-def create_badge(badge_name: str) -> Badge:
-    badge = Badge(badge_name=badge_name)
-    session.add(badge)
-    session.commit()
+def create_badge(badge_name: str, player_id: int | None = None) -> Badge:
+    badge = Badge(badge_name=badge_name, player_id=player_id)
+    # Rows owned by a player live on that player's shard
+    owner_session = session_for_player(player_id) if player_id is not None else session
+    owner_session.add(badge)
+    owner_session.commit()
     formatlog(f'New badge created with ID {badge.badge_id} and name "{badge_name}".')
     return badge
 
 
 def get_badge_from_id(badge_int: int) -> Badge | None:
-    badge = session.get(Badge, badge_int)
+    badge = get_from_any_shard(Badge, badge_int)
     if not badge:
         formatlog(f'Badge with ID "{badge_int}" not found in the database.')
     return badge
@@ -142,21 +419,22 @@ def get_badge_from_id(badge_int: int) -> Badge | None:
 
 def get_badges_from_player(player_id: int) -> list[Badge]:
     statement = select(Badge).where(Badge.player_id == player_id)
-    results = session.exec(statement)
+    results = session_for_player(player_id).exec(statement)
     return list(results.all())
 
 
 # <<< RPG Items >>>
-def create_rpg_item(item_name: str) -> RPGItem:
-    item = RPGItem(badge_name=item_name)
-    session.add(item)
-    session.commit()
+def create_rpg_item(item_name: str, player_id: int | None = None) -> RPGItem:
+    item = RPGItem(badge_name=item_name, player_id=player_id)
+    owner_session = session_for_player(player_id) if player_id is not None else session
+    owner_session.add(item)
+    owner_session.commit()
     formatlog(f'New RPG Item created with ID {item.item_id} and name "{item_name}".')
     return item
 
 
 def get_rpg_item_from_id(item_id: int) -> RPGItem | None:
-    item = session.get(RPGItem, item_id)
+    item = get_from_any_shard(RPGItem, item_id)
     if not item:
         formatlog(f'RPG Item with ID "{item_id}" not found in the database.')
     return item
@@ -164,21 +442,22 @@ def get_rpg_item_from_id(item_id: int) -> RPGItem | None:
 
 def get_rpg_items_from_player(player_id: int) -> list[RPGItem]:
     statement = select(RPGItem).where(RPGItem.player_id == player_id)
-    results = session.exec(statement)
+    results = session_for_player(player_id).exec(statement)
     return list(results.all())
 
 
 # <<< Valley Items >>>
-def create_valley_item(item_name: str) -> ValleyItem:
-    item = ValleyItem(badge_name=item_name)
-    session.add(item)
-    session.commit()
+def create_valley_item(item_name: str, player_id: int | None = None) -> ValleyItem:
+    item = ValleyItem(badge_name=item_name, player_id=player_id)
+    owner_session = session_for_player(player_id) if player_id is not None else session
+    owner_session.add(item)
+    owner_session.commit()
     formatlog(f'New Valley Item created with name ID "{item_name}".')
     return item
 
 
 def get_valley_item_from_id(item_id: int) -> ValleyItem | None:
-    item = session.get(ValleyItem, item_id)
+    item = get_from_any_shard(ValleyItem, item_id)
     if not item:
         formatlog(f'Valley Item with ID "{item_id}" not found in the database.')
     return item
@@ -186,21 +465,22 @@ def get_valley_item_from_id(item_id: int) -> ValleyItem | None:
 
 def get_valley_items_from_player(player_id: int) -> list[ValleyItem]:
     statement = select(ValleyItem).where(ValleyItem.player_id == player_id)
-    results = session.exec(statement)
+    results = session_for_player(player_id).exec(statement)
     return list(results.all())
 
 
 # <<< Units >>>
-def create_unit(unit_name: str) -> Unit:
-    unit = Unit(unit_name=unit_name)
-    session.add(unit)
-    session.commit()
+def create_unit(unit_name: str, player_id: int | None = None) -> Unit:
+    unit = Unit(unit_name=unit_name, player_id=player_id)
+    owner_session = session_for_player(player_id) if player_id is not None else session
+    owner_session.add(unit)
+    owner_session.commit()
     formatlog(f'New Unit created with ID {unit.unit_id} and name "{unit_name}".')
     return unit
 
 
 def get_unit_from_id(unit_id: int) -> Unit | None:
-    unit = session.get(Unit, unit_id)
+    unit = get_from_any_shard(Unit, unit_id)
     if not unit:
         formatlog(f'Unit with ID "{unit_id}" not found in the database.')
     return unit
@@ -208,15 +488,273 @@ def get_unit_from_id(unit_id: int) -> Unit | None:
 
 def get_units_from_player(player_id: int) -> list[Unit]:
     statement = select(Unit).where(Unit.player_id == player_id)
-    results = session.exec(statement)
+    results = session_for_player(player_id).exec(statement)
     return list(results.all())
 
 
+# <<< INVENTORY >>> #
+def get_inventory(player_id: int) -> dict[int, int]:
+    statement = select(InventoryItem.item_code, InventoryItem.amount).where(InventoryItem.player_id == player_id)
+    results = session_for_player(player_id).exec(statement)
+    return {item_code: amount for item_code, amount in results.all()}
+
+
+def add_inventory(player_id: int, increments: dict[int, int]) -> None:
+    """
+    Adds the given amounts to a player's inventory in one batched upsert. Like session.add, it is
+    committed by the next update_model call.
+    """
+    if not increments:
+        return
+    statement = sqlite_insert(InventoryItem)
+    statement = statement.on_conflict_do_update(
+        index_elements=[InventoryItem.player_id, InventoryItem.item_code],
+        set_={"amount": InventoryItem.amount + statement.excluded.amount}
+    )
+    session_for_player(player_id).execute(statement, [
+        {"player_id": player_id, "item_code": item_code, "amount": amount}
+        for item_code, amount in increments.items()
+    ])
+
+
+def get_top_inventory(item_codes: list[int], limit: int) -> list[tuple[int, int]]:
+    total = func.sum(InventoryItem.amount)
+
+    def top(shard: int) -> list[tuple[int, int]]:
+        statement = (
+            select(InventoryItem.player_id, total)
+            .where(col(InventoryItem.item_code).in_(item_codes))
+            .where(col(InventoryItem.player_id).in_(live_players(shard)))
+            .group_by(InventoryItem.player_id)
+            .order_by(total.desc(), col(InventoryItem.player_id).desc())
+            .limit(limit)
+        )
+        with Session(engines[shard]) as shard_session:
+            return list(shard_session.exec(statement).all())
+
+    # A player's rows all live on one shard, so the per-shard top lists can simply be merged
+    return heapq.nlargest(limit, (row for rows in fan_out(top) for row in rows), key=lambda row: (row[1], row[0]))
+
+
+def get_inventory_totals() -> dict[int, int]:
+    def totals(shard: int) -> list[tuple[int, int]]:
+        statement = (
+            select(InventoryItem.item_code, func.sum(InventoryItem.amount))
+            .where(col(InventoryItem.player_id).in_(live_players(shard)))
+            .group_by(InventoryItem.item_code)
+        )
+        with Session(engines[shard]) as shard_session:
+            return list(shard_session.exec(statement).all())
+
+    merged = {}
+    for rows in fan_out(totals):
+        for item_code, total in rows:
+            merged[item_code] = merged.get(item_code, 0) + (total or 0)
+    return merged
+
+
+# <<< LEADERBOARDS >>> #
+def update_leaderboard_score(board: str, player_id: int, score: int, size: int) -> None:
+    """
+    Updates a player's score on a top-N board, inserting them and evicting the lowest entry if
+    they beat it. Like add_inventory, it is committed by the next update_model call.
+    """
+    entry = session.get(LeaderboardEntry, (board, player_id))
+    if entry:
+        entry.score = score
+        session.add(entry)
+        return
+
+    count_statement = select(func.count()).select_from(LeaderboardEntry).where(LeaderboardEntry.board == board)
+    if session.exec(count_statement).one() < size:
+        session.add(LeaderboardEntry(board=board, player_id=player_id, score=score))
+        return
+
+    lowest_statement = (
+        select(LeaderboardEntry)
+        .where(LeaderboardEntry.board == board)
+        .order_by(col(LeaderboardEntry.score), col(LeaderboardEntry.player_id))
+        .limit(1)
+    )
+    lowest = session.exec(lowest_statement).first()
+    if lowest and (score, player_id) > (lowest.score, lowest.player_id):
+        session.delete(lowest)
+        session.add(LeaderboardEntry(board=board, player_id=player_id, score=score))
+
+
+def get_leaderboard_page(board: str, after: tuple[int, int] | None, limit: int) -> list[tuple[int, str | None, int]]:
+    statement = (
+        select(LeaderboardEntry.player_id, PlayerDirectory.mc_username, LeaderboardEntry.score)
+        .join(PlayerDirectory, col(PlayerDirectory.player_id) == LeaderboardEntry.player_id)
+        .where(LeaderboardEntry.board == board)
+    )
+    if after is not None:
+        after_score, after_player_id = after
+        statement = statement.where(
+            (col(LeaderboardEntry.score) < after_score)
+            | ((LeaderboardEntry.score == after_score) & (col(LeaderboardEntry.player_id) < after_player_id))
+        )
+    statement = statement.order_by(col(LeaderboardEntry.score).desc(), col(LeaderboardEntry.player_id).desc())
+    return list(session.exec(statement.limit(limit)).all())
+
+
+def replace_leaderboard(board: str, entries: list[tuple[int, int]]) -> None:
+    # Uses its own session, so the rebuild can run off the event loop
+    with Session(engine) as rebuild_session:
+        rebuild_session.execute(delete(LeaderboardEntry).where(col(LeaderboardEntry.board) == board))
+        rebuild_session.add_all(
+            LeaderboardEntry(board=board, player_id=player_id, score=score) for player_id, score in entries
+        )
+        rebuild_session.commit()
+
+
+# <<< STATS >>> #
+def increment_counters(increments: dict[str, int]) -> None:
+    """
+    Adds to server-wide counters in one batched upsert, committed by the next update_model call.
+    """
+    if not increments:
+        return
+    statement = sqlite_insert(StatCounter)
+    statement = statement.on_conflict_do_update(
+        index_elements=[StatCounter.name],
+        set_={"value": StatCounter.value + statement.excluded.value}
+    )
+    session.execute(statement, [{"name": name, "value": value} for name, value in increments.items()])
+
+
+def get_counters() -> dict[str, int]:
+    return {counter.name: counter.value for counter in session.exec(select(StatCounter)).all()}
+
+
+def set_counters(values: dict[str, int]) -> None:
+    with Session(engine) as rebuild_session:
+        for name, value in values.items():
+            rebuild_session.merge(StatCounter(name=name, value=value))
+        rebuild_session.commit()
+
+
+def get_top_total_pulls(limit: int) -> list[tuple[int, int]]:
+    def top(shard: int) -> list[tuple[int, int]]:
+        statement = (
+            select(DBPlayer.player_id, DBPlayer.total_pulls)
+            .where(col(DBPlayer.total_pulls) > 0)
+            .where(col(DBPlayer.player_id).in_(live_players(shard)))
+            .order_by(col(DBPlayer.total_pulls).desc(), col(DBPlayer.player_id).desc())
+            .limit(limit)
+        )
+        with Session(engines[shard]) as shard_session:
+            return list(shard_session.exec(statement).all())
+
+    return heapq.nlargest(limit, (row for rows in fan_out(top) for row in rows), key=lambda row: (row[1], row[0]))
+
+
+def get_player_totals() -> tuple[int, int]:
+    def totals(shard: int) -> tuple[int, int]:
+        statement = (
+            select(func.count(), func.coalesce(func.sum(DBPlayer.total_pulls), 0))
+            .select_from(DBPlayer)
+            .where(col(DBPlayer.player_id).in_(live_players(shard)))
+        )
+        with Session(engines[shard]) as shard_session:
+            return tuple(shard_session.exec(statement).one())
+
+    results = fan_out(totals)
+    return sum(players for players, _ in results), sum(pulls for _, pulls in results)
+
+
+# <<< IDEMPOTENCY KEYS >>> #
+def get_idempotency_key(key: str) -> IdempotencyKey | None:
+    idempotency_key = session.get(IdempotencyKey, key)
+    if idempotency_key:
+        # Detach it so it can be cached without being expired by later commits
+        session.expunge(idempotency_key)
+    return idempotency_key
+
+
+def save_idempotency_key(idempotency_key: IdempotencyKey) -> None:
+    session.merge(idempotency_key)
+    session.commit()
+
+
+def purge_expired_idempotency_keys(now: float, batch_size: int) -> int:
+    statement = select(IdempotencyKey.key).where(IdempotencyKey.expires_at < now).limit(batch_size)
+    keys = list(session.exec(statement).all())
+    if keys:
+        session.execute(delete(IdempotencyKey).where(col(IdempotencyKey.key).in_(keys)))
+        session.commit()
+    return len(keys)
+
+
 # <<< DATABASE >>> #
 def initialize_database() -> None:
-    SQLModel.metadata.create_all(engine)
+    """
+    Creates missing tables on every shard. Files that did not exist yet are stamped at the
+    latest Alembic revision, since create_all already gave them the current schema and replaying
+    the migrations on them would fail.
+    """
+    new_engines = [shard_engine for shard_engine in engines if not inspect(shard_engine).get_table_names()]
+    for shard_engine in engines:
+        SQLModel.metadata.create_all(shard_engine, tables=[model.__table__ for model in PLAYER_TABLES])
+    SQLModel.metadata.create_all(engine, tables=[model.__table__ for model in GLOBAL_TABLES])
+    script = ScriptDirectory(MIGRATIONS_DIR)
+    for shard_engine in new_engines:
+        with shard_engine.begin() as connection:
+            MigrationContext.configure(connection).stamp(script, "head")
+    backfill_directory()
+
+
+def backfill_directory() -> None:
+    """
+    Adds directory entries for players created before sharding, which all live on the home shard.
+    """
+    if session.exec(select(PlayerDirectory).limit(1)).first() is not None:
+        return
+    statement = select(DBPlayer.player_id, DBPlayer.itch_id, DBPlayer.mc_username)
+    for shard, shard_session in enumerate(sessions):
+        for player_id, itch_id, mc_username in shard_session.exec(statement).all():
+            session.add(PlayerDirectory(player_id=player_id, itch_id=itch_id, mc_username=mc_username, shard=shard))
+    session.commit()
 
 
 def update_model(model) -> None:
-    session.add(model)
+    """
+    Commits the model's shard and then the home shard. If a rebalance moved the player after the
+    model was loaded, PlayerMovedError is raised instead. On any failure both sessions are rolled
+    back, so half-done writes never get committed by a later request.
+    """
+    model_session = session_for_model(model)
+    player_id = model.player_id if isinstance(model, tuple(PLAYER_TABLES)) else None
+    try:
+        model_session.add(model)
+        # Flushing takes the shard's write lock first: a move that starts later waits for this
+        # commit, and one that already finished shows up in the directory check below
+        model_session.flush()
+        if player_id is not None and SHARD_COUNT > 1:
+            # Read the column directly, the cached directory entry may predate the move
+            statement = select(PlayerDirectory.shard).where(col(PlayerDirectory.player_id) == player_id)
+            shard = session.exec(statement).first()
+            if shard is not None and sessions[shard] is not model_session:
+                raise PlayerMovedError(player_id)
+        if isinstance(model, DBPlayer):
+            entry = get_directory_entry(model.player_id)
+            if entry and entry.mc_username != model.mc_username:
+                entry.mc_username = model.mc_username
+        model_session.commit()
+        # Global tables written in the same request (stats, leaderboards, directory) live on the home shard
+        session.commit()
+    except StaleDataError:
+        model_session.rollback()
+        session.rollback()
+        if player_id is None:
+            raise
+        # The player's row was deleted from this shard by a move that finished before the flush
+        raise PlayerMovedError(player_id)
+    except Exception:
+        model_session.rollback()
+        session.rollback()
+        raise
+
+
+def commit() -> None:
     session.commit()
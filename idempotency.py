@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import orjson
+from starlette.requests import Request
+from starlette.responses import Response
+
+import dbmanager
+from dbmanager import IdempotencyKey, formatlog
+
+IDEMPOTENCY_TTL = 24 * 60 * 60
+CACHE_SIZE = 1024
+PURGE_INTERVAL = 10 * 60
+PURGE_BATCH_SIZE = 500
+
+cache: OrderedDict[str, IdempotencyKey] = OrderedDict()
+in_flight: dict[str, asyncio.Future] = {}
+
+
+def scope_key(request: Request, token: str, idempotency_key: str) -> str:
+    scope = f"{token}\0{request.method} {request.url.path}\0{idempotency_key}"
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+async def request_hash(request: Request) -> str:
+    # The response format is part of the request, so a replay never answers in the wrong one
+    from api import negotiated_media_type
+    # FastAPI has already read the body, so this returns the cached bytes
+    body = await request.body()
+    fingerprint = f"{negotiated_media_type(request)}\0{request.url.query}\0".encode() + body
+    return hashlib.sha256(fingerprint).hexdigest()
+
+
+def cache_put(stored: IdempotencyKey) -> None:
+    cache[stored.key] = stored
+    cache.move_to_end(stored.key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def lookup(key: str) -> IdempotencyKey | None:
+    now = time.time()
+    stored = cache.get(key)
+    if stored is not None:
+        if stored.expires_at < now:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return stored
+    stored = dbmanager.get_idempotency_key(key)
+    if stored is None or stored.expires_at < now:
+        return None
+    cache_put(stored)
+    return stored
+
+
+def mismatch() -> Response:
+    return Response(
+        content=orjson.dumps({"error": "Idempotency-Key was already used for a different request"}),
+        status_code=422,
+        media_type="application/json",
+    )
+
+
+def replay(stored: IdempotencyKey) -> Response:
+    return Response(
+        content=stored.body,
+        status_code=stored.status_code,
+        media_type=stored.media_type,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def run_idempotent(
+        request: Request,
+        token: str,
+        idempotency_key: str | None,
+        handler: Callable[[], Awaitable[Response]]
+) -> Response:
+    """
+    Runs handler once per (token, route, Idempotency-Key) and replays the stored response for
+    repeats until the key expires. Duplicates that arrive while the first request is still
+    running wait for it instead of running handler again. Reusing a key with a different query
+    string, body or response format (Accept) is rejected with 422.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    key = scope_key(request, token, idempotency_key)
+    fingerprint = await request_hash(request)
+    while True:
+        stored = lookup(key)
+        if stored is not None:
+            return replay(stored) if stored.request_hash == fingerprint else mismatch()
+        pending = in_flight.get(key)
+        if pending is None:
+            break
+        # If the first request fails without storing a response, the next loop runs it again
+        await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    in_flight[key] = future
+    try:
+        response = await handler()
+        if response.status_code < 500:
+            stored = IdempotencyKey(
+                key=key,
+                request_hash=fingerprint,
+                status_code=response.status_code,
+                media_type=response.media_type or "application/json",
+                body=bytes(response.body),
+                expires_at=time.time() + IDEMPOTENCY_TTL,
+            )
+            cache_put(stored)
+            try:
+                dbmanager.save_idempotency_key(stored)
+            except Exception as e:
+                # The handler already committed, so the client still gets its response, and the
+                # cached copy replays it for retries reaching this process
+                dbmanager.session.rollback()
+                formatlog(f"Saving an idempotency key failed, it is only cached in memory: {e!r}")
+        return response
+    finally:
+        del in_flight[key]
+        future.set_result(None)
+
+
+async def purge_expired_keys() -> None:
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL)
+        purged = 0
+        try:
+            while True:
+                count = dbmanager.purge_expired_idempotency_keys(time.time(), PURGE_BATCH_SIZE)
+                purged += count
+                if count < PURGE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+        except Exception as e:
+            dbmanager.session.rollback()
+            formatlog(f"Purging expired idempotency keys failed, retrying next interval: {e!r}")
+        if purged:
+            formatlog(f"Purged {purged} expired idempotency keys.")
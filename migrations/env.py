@@ -60,6 +60,16 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # Each shard is a separate database, migrate the other shards one by one with e.g.
+    # alembic -x url=sqlite:///database_1.db upgrade head
+    # dbmanager.initialize_database() stamps the shard files it creates at head, so only newer
+    # revisions run on them. Shards only hold the player tables: a revision that touches the
+    # global tables (directory, leaderboards, stats, idempotency keys) must skip them when a url
+    # is passed.
+    url = context.get_x_argument(as_dictionary=True).get("url")
+    if url:
+        config.set_main_option("sqlalchemy.url", url)
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -0,0 +1,67 @@
+"""Added player directory for sharding
+
+Revision ID: c7e4a0b2f318
+Revises: 5d2f9a8e1c47
+Create Date: 2026-10-19 14:26:45.902317
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e4a0b2f318'
+down_revision: Union[str, Sequence[str], None] = '5d2f9a8e1c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('playerdirectory',
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('itch_id', sa.Integer(), nullable=True),
+    sa.Column('mc_username', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('player_id')
+    )
+    op.create_index(op.f('ix_playerdirectory_itch_id'), 'playerdirectory', ['itch_id'], unique=True)
+    op.create_index(op.f('ix_playerdirectory_mc_username'), 'playerdirectory', ['mc_username'], unique=False)
+    # Every existing player lives in this database, which becomes the home shard
+    op.execute(
+        "INSERT INTO playerdirectory (player_id, itch_id, mc_username, shard) "
+        "SELECT player_id, itch_id, mc_username, 0 FROM dbplayer"
+    )
+
+    # Leaderboards now reference the directory, since players may live on other shards.
+    # The table is materialized, so it is recreated empty and refilled by the next rebuild.
+    op.drop_index('ix_leaderboardentry_board_score', table_name='leaderboardentry')
+    op.drop_table('leaderboardentry')
+    op.create_table('leaderboardentry',
+    sa.Column('board', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['playerdirectory.player_id'], ),
+    sa.PrimaryKeyConstraint('board', 'player_id')
+    )
+    op.create_index('ix_leaderboardentry_board_score', 'leaderboardentry', ['board', 'score', 'player_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_leaderboardentry_board_score', table_name='leaderboardentry')
+    op.drop_table('leaderboardentry')
+    op.create_table('leaderboardentry',
+    sa.Column('board', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['dbplayer.player_id'], ),
+    sa.PrimaryKeyConstraint('board', 'player_id')
+    )
+    op.create_index('ix_leaderboardentry_board_score', 'leaderboardentry', ['board', 'score', 'player_id'], unique=False)
+    op.drop_index(op.f('ix_playerdirectory_mc_username'), table_name='playerdirectory')
+    op.drop_index(op.f('ix_playerdirectory_itch_id'), table_name='playerdirectory')
+    op.drop_table('playerdirectory')
@@ -0,0 +1,64 @@
+"""Moved currencies into inventory
+
+Revision ID: e83b51c0d7a2
+Revises: a41c7e2d9f05
+Create Date: 2026-10-19 11:03:58.671204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e83b51c0d7a2'
+down_revision: Union[str, Sequence[str], None] = 'a41c7e2d9f05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# dbplayer column -> item code, frozen from the objects.yaml inventory list at this revision
+MOVED_COLUMNS = {
+    'coins': 0,
+    'tickets': 1,
+    'candy_a': 2,
+    'candy_b': 3,
+    'candy_c': 4,
+    'candy_d': 5,
+    'candy_e': 6,
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('inventoryitem',
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('item_code', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['dbplayer.player_id'], ),
+    sa.PrimaryKeyConstraint('player_id', 'item_code'),
+    sqlite_with_rowid=False
+    )
+    for column, item_code in MOVED_COLUMNS.items():
+        op.execute(
+            f"INSERT INTO inventoryitem (player_id, item_code, amount) "
+            f"SELECT player_id, {item_code}, {column} FROM dbplayer WHERE {column} > 0"
+        )
+    with op.batch_alter_table('dbplayer') as batch_op:
+        for column in MOVED_COLUMNS:
+            batch_op.drop_column(column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('dbplayer') as batch_op:
+        for column in MOVED_COLUMNS:
+            batch_op.add_column(sa.Column(column, sa.INTEGER(), nullable=True))
+    for column, item_code in MOVED_COLUMNS.items():
+        op.execute(
+            f"UPDATE dbplayer SET {column} = COALESCE(("
+            f"SELECT amount FROM inventoryitem "
+            f"WHERE inventoryitem.player_id = dbplayer.player_id AND inventoryitem.item_code = {item_code}"
+            f"), 0)"
+        )
+    op.drop_table('inventoryitem')
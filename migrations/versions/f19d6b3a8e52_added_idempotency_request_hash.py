@@ -0,0 +1,33 @@
+"""Added idempotency request hash
+
+Revision ID: f19d6b3a8e52
+Revises: c7e4a0b2f318
+Create Date: 2026-10-19 16:05:12.447190
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f19d6b3a8e52'
+down_revision: Union[str, Sequence[str], None] = 'c7e4a0b2f318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Stored responses can't be matched to a request without the hash, so drop them
+    op.execute("DELETE FROM idempotencykey")
+    with op.batch_alter_table('idempotencykey') as batch_op:
+        batch_op.add_column(sa.Column('request_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False, server_default=''))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('idempotencykey') as batch_op:
+        batch_op.drop_column('request_hash')
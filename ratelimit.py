@@ -0,0 +1,160 @@
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from starlette.requests import Request
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter keyed by an arbitrary string. Buckets are kept in LRU order and the
+    least recently used one is evicted once max_keys is reached, so memory stays bounded.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def acquire(self, key: str, cost: float = 1) -> float:
+        """
+        Takes cost tokens from the bucket of key. Returns 0 if allowed, otherwise the seconds
+        to wait until enough tokens are available.
+        """
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = TokenBucket(self.burst, now)
+            self.buckets[key] = bucket
+        else:
+            self.buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return 0
+        return (cost - bucket.tokens) / self.rate
+
+    def check(self, key: str, cost: float = 1) -> None:
+        retry_after = self.acquire(key, cost)
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of concurrent operations. Callers over the cap are rejected right away
+    instead of queueing behind the running ones.
+    """
+
+    def __init__(self, limit: int, retry_after: float = 1):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.active = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.active >= self.limit:
+            raise RateLimitExceeded(self.retry_after)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+
+class KeyedConcurrencyLimiter:
+    """
+    Caps the number of concurrent operations per key, e.g. per client IP, so a single client
+    cannot take every slot of a shared ConcurrencyLimiter. Only keys with running operations are
+    kept, so memory stays bounded by the number of concurrent requests.
+    """
+
+    def __init__(self, limit: int, retry_after: float = 1):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.active: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        active = self.active.get(key, 0)
+        if active >= self.limit:
+            raise RateLimitExceeded(self.retry_after)
+        self.active[key] = active + 1
+        try:
+            yield
+        finally:
+            remaining = self.active[key] - 1
+            if remaining:
+                self.active[key] = remaining
+            else:
+                del self.active[key]
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+# <<< LIMITS >>> #
+MAX_PULLS_PER_REQUEST = 100
+
+gacha_player_limiter = RateLimiter(rate=1, burst=10)
+gacha_ip_limiter = RateLimiter(rate=5, burst=30)
+image_ip_limiter = RateLimiter(rate=5, burst=20)
+# itch.io lookups and image fetches get separate pools, so neither can starve the other
+auth_outbound_limiter = ConcurrencyLimiter(limit=16)
+image_outbound_limiter = ConcurrencyLimiter(limit=16)
+outbound_ip_limiter = KeyedConcurrencyLimiter(limit=4)
+
+
+def check_gacha_ip(request: Request) -> None:
+    """
+    Runs before the token is validated, so it is the only limit on unauthenticated clients
+    churning through random tokens.
+    """
+    gacha_ip_limiter.check(client_ip(request))
+
+
+def check_gacha_player(player_id: int) -> None:
+    """
+    Runs after the token is validated and only after the IP check passed, so buckets exist only
+    for real players and requests rejected by the IP limiter never spend a player's budget.
+    """
+    gacha_player_limiter.check(str(player_id))
+
+
+def check_image(request: Request) -> None:
+    image_ip_limiter.check(client_ip(request))
+
+
+@asynccontextmanager
+async def outbound_slot(pool: ConcurrencyLimiter, ip: str):
+    """
+    Takes a slot of pool for an outbound request made on behalf of ip. The per-IP cap is checked
+    first, so a client over it is rejected without ever holding a slot of the shared pool.
+    """
+    async with outbound_ip_limiter.slot(ip), pool.slot():
+        yield
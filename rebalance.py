@@ -0,0 +1,45 @@
+import argparse
+
+import dbmanager
+from dbmanager import formatlog
+
+BATCH_SIZE = 1000
+
+
+def rebalance() -> int:
+    """
+    Moves every player whose shard differs from the one their ID hashes to, e.g. after
+    CIRCUS_SHARD_COUNT was raised. Players are moved one at a time while the server keeps running.
+    """
+    moved = 0
+    after = 0
+    while True:
+        page = dbmanager.get_directory_page(after, BATCH_SIZE)
+        if not page:
+            return moved
+        for player_id, shard in page:
+            target_shard = dbmanager.shard_for_new_player(player_id)
+            if shard != target_shard and dbmanager.move_player(player_id, target_shard):
+                moved += 1
+        after = page[-1][0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move players between database shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    move_parser = subparsers.add_parser("move", help="Move one player to a shard")
+    move_parser.add_argument("player_id", type=int)
+    move_parser.add_argument("shard", type=int, choices=range(dbmanager.SHARD_COUNT))
+    subparsers.add_parser("rebalance", help="Move every player to the shard their ID hashes to")
+    args = parser.parse_args()
+
+    dbmanager.initialize_database()
+    if args.command == "move":
+        if not dbmanager.move_player(args.player_id, args.shard):
+            formatlog(f'Player "{args.player_id}" not found or already on shard {args.shard}.')
+    else:
+        formatlog(f"Rebalanced {rebalance()} players.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+
+import catalog
+import dbmanager
+from dbmanager import formatlog
+
+BOARDS = ("total_pulls", "coins", "units")
+LEADERBOARD_SIZE = 1000
+REBUILD_INTERVAL = 60 * 60
+
+
+# <<< INCREMENTAL UPDATES >>> #
+# These run inside the write path and are committed together with the player update.
+def record_new_player() -> None:
+    dbmanager.increment_counters({"players": 1})
+
+
+def record_pull(player: dbmanager.DBPlayer, pulls: int, items: dict[int, int]) -> None:
+    counters = {"pulls": pulls}
+    for item_code, amount in items.items():
+        rarity = catalog.UNIT_CODES.get(item_code)
+        if rarity is not None:
+            counters["units_pulled"] = counters.get("units_pulled", 0) + amount
+            counters[f"{rarity}_pulled"] = counters.get(f"{rarity}_pulled", 0) + amount
+        elif item_code == catalog.COINS_CODE:
+            counters["coins_pulled"] = amount
+    dbmanager.increment_counters(counters)
+
+    inventory = dbmanager.get_inventory(player.player_id)
+    scores = {
+        "total_pulls": player.total_pulls,
+        "coins": inventory.get(catalog.COINS_CODE, 0),
+        "units": sum(amount for code, amount in inventory.items() if code in catalog.UNIT_CODES),
+    }
+    for board, score in scores.items():
+        if score > 0:
+            dbmanager.update_leaderboard_score(board, player.player_id, score, LEADERBOARD_SIZE)
+
+
+def record_tokens(amount: int) -> None:
+    dbmanager.increment_counters({"tokens_granted": amount})
+
+
+def record_event(event_id: str) -> None:
+    dbmanager.increment_counters({"events_triggered": 1, f"event_{event_id}": 1})
+
+
+# <<< READS >>> #
+def encode_cursor(score: int, player_id: int) -> str:
+    return f"{score}:{player_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, int] | None:
+    try:
+        score, player_id = cursor.split(":")
+        return int(score), int(player_id)
+    except ValueError:
+        return None
+
+
+def get_leaderboard(
+        board: str,
+        after: tuple[int, int] | None,
+        limit: int
+) -> tuple[list[tuple[int, str | None, int]], str | None]:
+    """
+    Returns the page of the board after the decoded cursor and the cursor for the next one. Pages
+    are read by keyset (score, player_id), so each read costs O(limit) regardless of the board
+    position.
+    """
+    entries = dbmanager.get_leaderboard_page(board, after, limit)
+    next_cursor = None
+    if len(entries) == limit:
+        player_id, _, score = entries[-1]
+        next_cursor = encode_cursor(score, player_id)
+    return entries, next_cursor
+
+
+# <<< REBUILD >>> #
+def rebuild() -> None:
+    """
+    Recomputes the boards and the derivable counters from the source tables, fixing any drift
+    left by the incremental updates (e.g. players whose score dropped below the cutoff).
+    """
+    unit_codes = list(catalog.UNIT_CODES)
+    dbmanager.replace_leaderboard("total_pulls", dbmanager.get_top_total_pulls(LEADERBOARD_SIZE))
+    dbmanager.replace_leaderboard("coins", dbmanager.get_top_inventory([catalog.COINS_CODE], LEADERBOARD_SIZE))
+    dbmanager.replace_leaderboard("units", dbmanager.get_top_inventory(unit_codes, LEADERBOARD_SIZE))
+
+    players, pulls = dbmanager.get_player_totals()
+    counters = {"players": players, "pulls": pulls, "units_pulled": 0}
+    for rarity in catalog.UNIT_RARITIES:
+        counters[f"{rarity}_pulled"] = 0
+    for item_code, total in dbmanager.get_inventory_totals().items():
+        rarity = catalog.UNIT_CODES.get(item_code)
+        if rarity is not None:
+            counters["units_pulled"] += total
+            counters[f"{rarity}_pulled"] += total
+    dbmanager.set_counters(counters)
+
+
+async def rebuild_periodically() -> None:
+    while True:
+        try:
+            # The rebuild scans whole tables, so keep it off the event loop
+            await asyncio.to_thread(rebuild)
+            formatlog("Rebuilt leaderboards and stats.")
+        except Exception as e:
+            formatlog(f"Rebuilding leaderboards and stats failed, retrying next interval: {e!r}")
+        await asyncio.sleep(REBUILD_INTERVAL)